@@ -1,7 +1,40 @@
-import itertools
+import functools
 import random
 
 
+@functools.cache
+def neighbours(height, width):
+    """
+    Returns a dictionary mapping every cell of a `height` x `width` board
+    to the tuple of cells around it, not including the cell itself.
+    """
+    cells = {}
+    for i in range(height):
+        for j in range(width):
+            cells[i, j] = tuple(
+                (ni, nj)
+                for ni in range(max(i - 1, 0), min(i + 2, height))
+                for nj in range(max(j - 1, 0), min(j + 2, width))
+                if (ni, nj) != (i, j)
+            )
+    return cells
+
+
+@functools.cache
+def neighbour_masks(height, width):
+    """
+    Returns a tuple holding, for every cell of a `height` x `width` board in
+    row-major order, the bitmask of the cells around it.
+    """
+    masks = []
+    for cells in neighbours(height, width).values():
+        mask = 0
+        for i, j in cells:
+            mask |= 1 << (i * width + j)
+        masks.append(mask)
+    return tuple(masks)
+
+
 class Minesweeper:
     """
     Minesweeper game representation
@@ -12,23 +45,18 @@ class Minesweeper:
         # Set initial width, height, and number of mines
         self.height = height
         self.width = width
-        self.mines = set()
 
-        # Initialize an empty field with no mines
-        self.board = []
-        for _ in range(height):
-            row = []
-            for _ in range(width):
-                row.append(False)
-            self.board.append(row)
-
-        # Add mines randomly
-        while len(self.mines) != mines:
-            i = random.randrange(height)
-            j = random.randrange(width)
-            if not self.board[i][j]:
-                self.mines.add((i, j))
-                self.board[i][j] = True
+        # Add mines randomly; bit `i * width + j` of the bitboard is set for
+        # every mine at (i, j)
+        mines_idx = random.sample(range(height * width), mines)
+        self.mines = frozenset(divmod(idx, width) for idx in mines_idx)
+        self.mines_bb = 0
+        for idx in mines_idx:
+            self.mines_bb |= 1 << idx
+
+        # Bitmask of the neighbours of each cell, shared by every game
+        # played on a board of the same size
+        self.neighbour_masks = neighbour_masks(height, width)
 
         # At first, player has found no mines
         self.mines_found = set()
@@ -41,7 +69,7 @@ class Minesweeper:
         for i in range(self.height):
             print("--" * self.width + "-")
             for j in range(self.width):
-                if self.board[i][j]:
+                if self.is_mine((i, j)):
                     print("|X", end="")
                 else:
                     print("| ", end="")
@@ -50,7 +78,7 @@ class Minesweeper:
 
     def is_mine(self, cell):
         i, j = cell
-        return self.board[i][j]
+        return bool((self.mines_bb >> (i * self.width + j)) & 1)
 
     def nearby_mines(self, cell: tuple[int, int]):
         """
@@ -58,24 +86,9 @@ class Minesweeper:
         within one row and column of a given cell,
         not including the cell itself.
         """
-
-        # Keep count of nearby mines
-        count = 0
-
-        # Loop over all cells within one row and column
-        for i in range(cell[0] - 1, cell[0] + 2):
-            for j in range(cell[1] - 1, cell[1] + 2):
-
-                # Ignore the cell itself
-                if (i, j) == cell:
-                    continue
-
-                # Update count if cell in bounds and is mine
-                if 0 <= i < self.height and 0 <= j < self.width:
-                    if self.board[i][j]:
-                        count += 1
-
-        return count
+        i, j = cell
+        mask = self.neighbour_masks[i * self.width + j]
+        return (self.mines_bb & mask).bit_count()
 
     def won(self):
         """
@@ -98,6 +111,11 @@ class Sentence:
     def __eq__(self, other):
         return self.cells == other.cells and self.count == other.count
 
+    def __hash__(self):
+        # Cells change as mines and safes are marked, so the hash is only
+        # stable while the sentence is not being updated
+        return hash((frozenset(self.cells), self.count))
+
     def __str__(self):
         return f"{self.cells} = {self.count}"
 
@@ -119,6 +137,18 @@ class Sentence:
         else:
             return None
 
+    def known(self):
+        """
+        Returns a pair `(kind, cells)` where kind is 1 if all of self.cells
+        are known to be mines, -1 if they are all known to be safe, and 0
+        with cells None otherwise. cells is self.cells itself, not a copy.
+        """
+        if self.count == 0:
+            return -1, self.cells
+        if len(self.cells) == self.count:
+            return 1, self.cells
+        return 0, None
+
     def mark_mine(self, cell):
         """
         Updates internal knowledge representation given the fact that
@@ -147,6 +177,7 @@ class MinesweeperAI:
         # Set initial height and width
         self.height = height
         self.width = width
+        self.neighbours = neighbours(height, width)
 
         # Keep track of which cells have been clicked on
         self.moves_made = set()
@@ -155,9 +186,20 @@ class MinesweeperAI:
         self.mines = set()
         self.safes = set()
 
+        # Cells known to be safe that have not been clicked on yet
+        self.safe_unplayed = set()
+
         # List of sentences about the game known to be true
         self.knowledge = []
 
+        # Sentences added or changed since they were last compared with the
+        # rest of the knowledge, keyed by id
+        self.dirty = {}
+
+        # Sentences added or changed since they were last checked for known
+        # mines or safes, keyed by id
+        self.unchecked = {}
+
     def mark_mine(self, cell):
         """
         Marks a cell as a mine, and updates all knowledge
@@ -165,7 +207,10 @@ class MinesweeperAI:
         """
         self.mines.add(cell)
         for sentence in self.knowledge:
-            sentence.mark_mine(cell)
+            if cell in sentence.cells:
+                sentence.mark_mine(cell)
+                self.dirty[id(sentence)] = sentence
+                self.unchecked[id(sentence)] = sentence
 
     def mark_safe(self, cell):
         """
@@ -174,8 +219,13 @@ class MinesweeperAI:
         """
         if not cell in self.safes:
             self.safes.add(cell)
+            if cell not in self.moves_made:
+                self.safe_unplayed.add(cell)
             for sentence in self.knowledge:
-                sentence.mark_safe(cell)
+                if cell in sentence.cells:
+                    sentence.mark_safe(cell)
+                    self.dirty[id(sentence)] = sentence
+                    self.unchecked[id(sentence)] = sentence
 
     def add_knowledge(self, cell, count):
         """
@@ -193,6 +243,7 @@ class MinesweeperAI:
                if they can be inferred from existing knowledge
         """
         self.moves_made.add(cell)
+        self.safe_unplayed.discard(cell)
         self.mark_safe(cell)
         self.add_neighbour_mines_knowledge(cell, count)
         self.mark_safe_and_mine()
@@ -207,10 +258,9 @@ class MinesweeperAI:
         This function may use the knowledge in self.mines, self.safes
         and self.moves_made, but should not modify any of those values.
         """
-        try:
-            return (self.safes - self.moves_made).pop()
-        except Exception:
-            return None
+        if self.safe_unplayed:
+            return next(iter(self.safe_unplayed))
+        return None
 
     def make_random_move(self):
         """
@@ -236,76 +286,113 @@ class MinesweeperAI:
         cells and count of mine passed to it.
         """
         neighbour_cells = []
-        for i in range(cell[0] - 1, cell[0] + 2):
-            for j in range(cell[1] - 1, cell[1] + 2):
-                if 0 <= i < self.height and 0 <= j < self.width:
-                    current_cell = (i, j)
-                    if current_cell in self.mines:
-                        count -= 1
-                    elif not current_cell in [*self.moves_made, *self.safes]:
-                        neighbour_cells.append(current_cell)
-        self.knowledge.append(Sentence(neighbour_cells, count))
+        for current_cell in self.neighbours[cell]:
+            if current_cell in self.mines:
+                count -= 1
+            elif current_cell not in self.safes:
+                neighbour_cells.append(current_cell)
+
+        # Sentences where every cell is safe or every cell is a mine are
+        # resolved right away instead of being added to the knowledge
+        if not neighbour_cells:
+            return
+        if count == 0:
+            for current_cell in neighbour_cells:
+                self.mark_safe(current_cell)
+        elif count == len(neighbour_cells):
+            for current_cell in neighbour_cells:
+                self.mark_mine(current_cell)
+        else:
+            self.add_sentence(Sentence(neighbour_cells, count))
+
+    def add_sentence(self, sentence):
+        """
+        Appends a sentence to the knowledge and queues it to be compared
+        with the rest of the knowledge.
+        """
+        self.knowledge.append(sentence)
+        self.dirty[id(sentence)] = sentence
+        self.unchecked[id(sentence)] = sentence
 
     def mark_safe_and_mine(self):
         """
         This method checks if any new mine or safe cell can be found by sentences
         in knowledge
         """
-        flag = True
-        while flag:
-            flag = False
-            for sentence in self.knowledge.copy():
-                mines = sentence.known_mines()
-                safes = sentence.known_safes()
-                if mines or safes:
-                    self.knowledge.remove(sentence)
-                    flag = True
-                if mines:
-                    for mine in mines:
-                        self.mark_mine(mine)
-                if safes:
-                    for safe in safes:
-                        self.mark_safe(safe)
-        for sentence in self.knowledge.copy():
-            if sentence.cells == set([]):
-                self.knowledge.remove(sentence)
+        # Only sentences that changed since the last check can have become
+        # resolvable. Resolved sentences leave the knowledge before their cells
+        # are marked, so marking can't change the sets being iterated.
+        while self.unchecked:
+            resolved = []
+            for sentence in self.unchecked.values():
+                kind, cells = sentence.known()
+                if kind or not sentence.cells:
+                    resolved.append((sentence, kind, cells))
+            self.unchecked = {}
+            if not resolved:
+                break
+
+            resolved_ids = {id(sentence) for sentence, _, _ in resolved}
+            self.knowledge = [
+                sentence
+                for sentence in self.knowledge
+                if id(sentence) not in resolved_ids
+            ]
+            for _, kind, cells in resolved:
+                if kind > 0:
+                    for cell in cells:
+                        self.mark_mine(cell)
+                elif kind < 0:
+                    for cell in cells:
+                        self.mark_safe(cell)
 
     def extract_from_problem(self):
         """
         This method extracts new infomation from given knowledge by using concept
         of subset.
         """
-        self.remove_same_sentence()
-        knowledge_subset_list = []
-        remove_sentence = []
-        flag = False
-        for (k1, k2) in itertools.permutations(self.knowledge, 2):
-            s1, s2 = k1.cells, k2.cells
-            if s1.issubset(s2):
-                knowledge_subset_list.append((k1, k2))
-                remove_sentence.append(k2)
-                flag = True
-
-        for (k1, k2) in knowledge_subset_list:
-            s = k2.cells - k1.cells
-            c = k2.count - k1.count
-            self.knowledge.append(Sentence(s, c))
-
-        for sentence in remove_sentence:
-            if sentence in self.knowledge:
-                self.knowledge.remove(sentence)
-
-        if flag:
-            self.mark_safe_and_mine()
-            self.extract_from_problem()
+        # Only sentences added or changed since they were last compared can
+        # form a subset pair that hasn't been used already
+        while self.dirty:
+            self.remove_same_sentence()
+            live = {id(sentence) for sentence in self.knowledge}
+            pending = [
+                sentence for key, sentence in self.dirty.items() if key in live
+            ]
+            self.dirty = {}
+
+            # Keyed by the ids of both sentences, so a pair of two pending
+            # sentences is only used once in this pass
+            pairs = {}
+            for sentence in pending:
+                if not sentence.cells:
+                    continue
+                for other in self.knowledge:
+                    if sentence.cells < other.cells:
+                        pairs[id(sentence), id(other)] = (sentence, other)
+                    elif other.cells < sentence.cells:
+                        pairs[id(other), id(sentence)] = (other, sentence)
+
+            new_sentences = []
+            remove_sentence = set()
+            for k1, k2 in pairs.values():
+                s = k2.cells - k1.cells
+                c = k2.count - k1.count
+                new_sentences.append(Sentence(s, c))
+                remove_sentence.add(id(k2))
+
+            if new_sentences:
+                self.knowledge = [
+                    sentence
+                    for sentence in self.knowledge
+                    if id(sentence) not in remove_sentence
+                ]
+                for sentence in new_sentences:
+                    self.add_sentence(sentence)
+                self.mark_safe_and_mine()
 
     def remove_same_sentence(self):
         """
         This method makes sure that knowledge must have unique sentences.
         """
-        new_knowledge = []
-        for sentence in self.knowledge:
-            if sentence not in new_knowledge:
-                new_knowledge.append(sentence)
-
-        self.knowledge = new_knowledge
+        self.knowledge = list(dict.fromkeys(self.knowledge))
@@ -2,9 +2,33 @@ import nltk
 import sys
 import os
 import math
+import contextlib
+import dbm
+import hashlib
+import heapq
+import pickle
+import shelve
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 FILE_MATCHES = 1
 SENTENCE_MATCHES = 1
+# Total characters of text below which starting worker processes costs more
+# than tokenizing in this process
+PARALLEL_MIN_CHARS = 1_000_000
+TOKENS_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".qcache")
+# Seconds after which a lock left behind by a killed run is ignored
+CACHE_LOCK_TIMEOUT = 600
+# Bump whenever `tokenize` or `tokenize_sentences` changes
+CACHE_VERSION = 1
+STOPWORDS = frozenset(nltk.corpus.stopwords.words("english"))
+# Everything besides the file itself that cached tokens depend on
+TOKENIZER = (
+    CACHE_VERSION,
+    nltk.__version__,
+    hashlib.sha256("\n".join(sorted(STOPWORDS)).encode()).hexdigest(),
+)
 
 
 def main():
@@ -13,9 +37,11 @@ def main():
     if len(sys.argv) != 2:
         sys.exit("Usage: python questions.py corpus")
 
-    # Calculate IDF values across files
-    files = load_files(sys.argv[1])
-    file_words = {filename: tokenize(files[filename]) for filename in files}
+    # Calculate IDF values across files, reusing the tokens of files that
+    # haven't changed since the last run
+    stamps = {}
+    files = load_files(sys.argv[1], stamps)
+    file_words = tokenize_files(files, stamps)
     file_idfs = compute_idfs(file_words)
 
     # Prompt user for query
@@ -27,11 +53,7 @@ def main():
     # Extract sentences from top files
     sentences = dict()
     for filename in filenames:
-        for passage in files[filename].split("\n"):
-            for sentence in nltk.sent_tokenize(passage):
-                tokens = tokenize(sentence)
-                if tokens:
-                    sentences[sentence] = tokens
+        sentences.update(tokenize_file_sentences(files[filename], stamps[filename]))
 
     # Compute IDF values across sentences
     idfs = compute_idfs(sentences)
@@ -42,18 +64,161 @@ def main():
         print(match)
 
 
-def load_files(directory: str) -> dict[str, str]:
+def load_files(directory: str, stamps: dict | None = None) -> dict[str, str]:
     """
     Given a directory name, return a dictionary mapping the filename of each
     `.txt` file inside that directory to the file's contents as a string.
+
+    If `stamps` is given, it is filled with the absolute path of each file
+    and a `(mtime_ns, size)` pair that changes whenever the file does.
     """
     data = {}
-    for file in filter(lambda x: x.endswith(".txt"), os.listdir(directory)):
-        with open(os.path.join(directory, file), encoding="utf8") as f:
-            data[file] = f.read()
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(".txt"):
+                with open(entry.path, encoding="utf8") as f:
+                    data[entry.name] = f.read()
+                if stamps is not None:
+                    stat = entry.stat()
+                    stamps[entry.name] = (
+                        os.path.abspath(entry.path),
+                        (stat.st_mtime_ns, stat.st_size),
+                    )
     return data
 
 
+@contextlib.contextmanager
+def open_cache():
+    """
+    Yield the tokens cache. If it can't be used, e.g. in a read-only
+    checkout or while another run holds its lock, yield an empty dictionary
+    that is discarded afterwards instead.
+    """
+    lock_path = TOKENS_CACHE + ".lock"
+    try:
+        if time.time() - os.path.getmtime(lock_path) > CACHE_LOCK_TIMEOUT:
+            os.remove(lock_path)
+    except OSError:
+        pass
+    try:
+        lock = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError:
+        yield {}
+        return
+
+    try:
+        try:
+            store = shelve.open(TOKENS_CACHE)
+        except (OSError, *dbm.error):
+            store = contextlib.nullcontext({})
+        with store as cache:
+            yield cache
+    finally:
+        os.close(lock)
+        os.remove(lock_path)
+
+
+def read_entry(cache, path: str, stamp: tuple) -> dict | None:
+    """
+    Return the entry cached for the file at `path`, or None if there is none
+    or it wasn't made from the same `stamp` by the current tokenizer.
+    """
+    try:
+        entry = cache.get(path)
+    except Exception:
+        # A corrupt entry counts as a miss and is overwritten later
+        return None
+    if (
+        not isinstance(entry, dict)
+        or entry.get("stamp") != stamp
+        or entry.get("tokenizer") != TOKENIZER
+    ):
+        return None
+    return entry
+
+
+def write_entry(cache, path: str, entry: dict):
+    """
+    Store `entry` for the file at `path`, leaving the cache as it is if it
+    can't be written.
+    """
+    try:
+        cache[path] = entry
+    except (OSError, *dbm.error, pickle.PicklingError):
+        pass
+
+
+def tokenize_files(files: dict[str, str], stamps: dict) -> dict[str, list[str]]:
+    """
+    Given a dictionary of `files` mapping filenames to their contents, and
+    their `stamps` from `load_files`, return a dictionary mapping each
+    filename to its list of words.
+
+    Each file is cached under its path along with its stamp, so a file is
+    only tokenized again after it or the tokenizer changes, and its old
+    entry is replaced.
+    """
+    file_words = {}
+    with open_cache() as cache:
+        for filename in files:
+            entry = read_entry(cache, *stamps[filename])
+            if entry is not None:
+                file_words[filename] = entry["words"]
+
+        missing = [filename for filename in files if filename not in file_words]
+        documents = [files[filename] for filename in missing]
+        for filename, words in zip(missing, tokenize_all(documents)):
+            path, stamp = stamps[filename]
+            write_entry(
+                cache,
+                path,
+                {"tokenizer": TOKENIZER, "stamp": stamp, "words": words},
+            )
+            file_words[filename] = words
+    return file_words
+
+
+def tokenize_file_sentences(document: str, file_stamp: tuple) -> dict:
+    """
+    Like `tokenize_sentences`, but reuses the sentences cached for the file
+    with the given `file_stamp` from `load_files` when it hasn't changed.
+    """
+    with open_cache() as cache:
+        entry = read_entry(cache, *file_stamp)
+        if entry is None:
+            return tokenize_sentences(document)
+        if "sentences" not in entry:
+            entry["sentences"] = tokenize_sentences(document)
+            write_entry(cache, file_stamp[0], entry)
+        return entry["sentences"]
+
+
+def tokenize_all(documents: list[str]) -> list[list[str]]:
+    """
+    Given a list of documents, return the list of words of each of them, in
+    the same order.
+    """
+    # Tokenizing is CPU bound, so spread large batches across processes
+    if len(documents) > 1 and sum(map(len, documents)) >= PARALLEL_MIN_CHARS:
+        with ProcessPoolExecutor() as executor:
+            return list(executor.map(tokenize, documents))
+    return [tokenize(document) for document in documents]
+
+
+def tokenize_sentences(document: str) -> dict[str, list[str]]:
+    """
+    Given a document (represented as a string), return a dictionary mapping
+    each of its sentences that has at least one word to its list of words.
+    """
+    sentences = {}
+    for passage in document.split("\n"):
+        for sentence in nltk.sent_tokenize(passage):
+            tokens = tokenize(sentence)
+            if tokens:
+                sentences[sentence] = tokens
+    return sentences
+
+
 def tokenize(document: str) -> list[str]:
     """
     Given a document (represented as a string), return a list of all of the
@@ -62,12 +227,12 @@ def tokenize(document: str) -> list[str]:
     Process document by coverting all words to lowercase, and removing any
     punctuation or English stopwords.
     """
-    stopwords = set(nltk.corpus.stopwords.words("english"))
-    return [
-        word.lower()
-        for word in nltk.word_tokenize(document)
-        if word.isalpha() and word not in stopwords
-    ]
+    words = []
+    for word in nltk.word_tokenize(document):
+        word = word.lower()
+        if word not in STOPWORDS and word.isalpha():
+            words.append(word)
+    return words
 
 
 def compute_idfs(documents: dict) -> dict[str, float]:
@@ -78,13 +243,13 @@ def compute_idfs(documents: dict) -> dict[str, float]:
     Any word that appears in at least one of the documents should be in the
     resulting dictionary.
     """
-    words = set()
+    # Number of documents each word appears in, counting a word once per document
+    frequencies = Counter()
     for word_list in documents.values():
-        words.update(word_list)
+        frequencies.update(set(word_list))
     corpus_length = len(documents)
     idfs = {}
-    for word in words:
-        f: int = sum(word in documents[file] for file in documents)
+    for word, f in frequencies.items():
         idfs[word] = math.log(corpus_length / f)
     return idfs
 
@@ -96,17 +261,15 @@ def top_files(query, files, idfs, n) -> list[str]:
     to their IDF values), return a list of the filenames of the the `n` top
     files that match the query, ranked according to tf-idf.
     """
+    # Look up the IDF of each query word once; a word that isn't found in
+    # corpus adds nothing, so it is left out entirely.
+    weights = [(word, idfs[word]) for word in query if word in idfs]
     tfidfs = {}
     for file in files:
-        sum = 0
-        for word in query:
-            # Making an exception if word isn't found in corpus and add nothing.
-            try:
-                sum += files[file].count(word) * idfs[word]
-            except KeyError:
-                pass
-        tfidfs[file] = sum
-    return sorted(tfidfs, key=lambda file: tfidfs[file], reverse=True)[:n]
+        # Count every word of the file in one pass instead of once per query word
+        tfs = Counter(files[file])
+        tfidfs[file] = sum(tfs[word] * idf for word, idf in weights)
+    return heapq.nlargest(n, tfidfs, key=tfidfs.get)
 
 
 def top_sentences(query: set[str], sentences, idfs, n):
@@ -117,23 +280,16 @@ def top_sentences(query: set[str], sentences, idfs, n):
     the query, ranked according to idf. If there are ties, preference should
     be given to sentences that have a higher query term density.
     """
-    tfidfs = {}
-    for sentence in sentences:
-        sum = 0
-        for word in query:
-            try:
-                sum += idfs[word] if word in sentences[sentence] else 0
-            except KeyError:
-                pass
-        tfidfs[sentence] = sum
-    return sorted(
-        tfidfs,
-        key=lambda s: (
-            tfidfs[s],
-            len(query.intersection(set(sentences[s]))) / len(sentences[s]),
-        ),
-        reverse=True,
-    )[:n]
+    ranks = {}
+    for sentence, words in sentences.items():
+        # Build the set of words once per sentence for both the idf sum and
+        # the query term density
+        word_set = set(words)
+        ranks[sentence] = (
+            sum(idfs.get(word, 0) for word in query if word in word_set),
+            len(query & word_set) / len(words),
+        )
+    return heapq.nlargest(n, ranks, key=ranks.get)
 
 
 if __name__ == "__main__":